@@ -0,0 +1,337 @@
+"""
+JWT Common - Shared helpers for server_jwt_generator.py and local_jwt_sync.py
+Status output, JSON files, app configuration and Keeper access used by both scripts
+"""
+
+import os
+import sys
+import json
+import logging
+import functools
+import threading
+import tempfile
+import time
+import types
+
+try:
+    import orjson  # Optional - faster JSON parsing/serialization
+except ImportError:
+    orjson = None
+
+# KSM Configuration - Use standard filename
+KSM_CONFIG_FILE = "client-config.json"
+
+# Application Configuration (can be environment variables or simple config file)
+APP_CONFIG_FILE = "app_config.json"
+
+# Record UIDs every script needs from the app configuration
+REQUIRED_APP_CONFIG_KEYS = ['jwt_token_record_uid', 'jwt_config_record_uid']
+
+# Template written when no app configuration exists; its values mark unset Record UIDs
+APP_CONFIG_TEMPLATE = {
+    "jwt_token_record_uid": "YOUR_JWT_TOKEN_RECORD_UID",
+    "jwt_config_record_uid": "YOUR_JWT_CONFIG_RECORD_UID"
+}
+PLACEHOLDERS = frozenset(APP_CONFIG_TEMPLATE.values())
+
+# Status markers - emoji on a terminal, plain text when piped (CI logs, cron mail)
+IS_TTY = sys.stdout.isatty()
+OK = "✅ " if IS_TTY else "[OK] "
+ERR = "❌ " if IS_TTY else "[ERROR] "
+WARN = "⚠️  " if IS_TTY else "[WARN] "
+INFO = "ℹ️  " if IS_TTY else "[INFO] "
+
+# Status output is queued and written to stdout in one go by flush_output()
+_output_buffer = []
+
+# Worker threads started through run_captured() queue their lines separately
+_capture = threading.local()
+
+class _StatusBufferHandler(logging.Handler):
+    """Logging handler that queues formatted status lines for flush_output()"""
+    def emit(self, record):
+        getattr(_capture, 'lines', _output_buffer).append(record.getMessage())
+
+def _log_level(name):
+    """Map a JWT_LOG_LEVEL name to a logging level (INFO when it isn't a known level name)"""
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else logging.INFO
+
+# Status lines go through logging so JWT_LOG_LEVEL (e.g. WARNING) can quiet them
+_status_log = logging.getLogger("jwt_status")
+_status_log.propagate = False
+_status_log.addHandler(_StatusBufferHandler())
+_status_log.setLevel(_log_level(os.getenv("JWT_LOG_LEVEL", "INFO")))
+
+def say(message=""):
+    """Queue a status line for output"""
+    _status_log.info(message)
+
+def say_warning(message):
+    """Queue a warning status line (still shown when JWT_LOG_LEVEL=WARNING)"""
+    _status_log.warning(message)
+
+def say_error(message):
+    """Queue an error status line (still shown when JWT_LOG_LEVEL=ERROR)"""
+    _status_log.error(message)
+
+def run_captured(func, *args, **kwargs):
+    """Call func with its status lines collected apart from the main output (for worker threads)
+    
+    Returns (result, lines) so the caller can replay the lines with say_lines() in step order.
+    If func raises, the lines queued so far are attached to the exception as status_lines.
+    """
+    lines = _capture.lines = []
+    try:
+        return func(*args, **kwargs), lines
+    except Exception as e:
+        e.status_lines = lines
+        raise
+    finally:
+        del _capture.lines
+
+def say_lines(lines):
+    """Queue status lines collected by run_captured() (already level-filtered)"""
+    getattr(_capture, 'lines', _output_buffer).extend(lines)
+
+def flush_output():
+    """Write all queued status lines to stdout in a single call"""
+    if _output_buffer:
+        sys.stdout.write("\n".join(_output_buffer) + "\n")
+        sys.stdout.flush()
+        _output_buffer.clear()
+
+def read_json_file(path):
+    """Read a JSON file (uses orjson when installed)"""
+    if orjson:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def dump_json(obj, indent=False):
+    """Serialize to JSON bytes, 2-space indented if requested (uses orjson when installed)"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    # Compact separators and raw UTF-8 match orjson, so log lines look the same with or without it
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def write_json_file(obj, path):
+    """Write a JSON file with 2-space indentation (uses orjson when installed)"""
+    # Written to a temp file and renamed, so an interrupted write never leaves truncated JSON
+    _atomic_write(path, dump_json(obj, indent=True), 0o644)
+
+@functools.lru_cache(maxsize=1)
+def _read_app_config(path, mtime_ns):
+    """Parse the app config file (memoized per file version)"""
+    return read_json_file(path)
+
+def load_app_config():
+    """Load application configuration (Record UIDs)"""
+
+    config = {}
+
+    # Try environment variables first
+    if os.getenv("JWT_TOKEN_RECORD_UID") and os.getenv("JWT_CONFIG_RECORD_UID"):
+        config = {
+            "jwt_token_record_uid": os.getenv("JWT_TOKEN_RECORD_UID"),
+            "jwt_config_record_uid": os.getenv("JWT_CONFIG_RECORD_UID")
+        }
+        say("📋 Using configuration from environment variables")
+        return config
+
+    # Try app config file (a missing file falls through to the template)
+    try:
+        config = dict(_read_app_config(APP_CONFIG_FILE, os.stat(APP_CONFIG_FILE).st_mtime_ns))
+        say(f"📋 Using configuration from {APP_CONFIG_FILE}")
+        return config
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        say_error(f"{ERR}Error reading {APP_CONFIG_FILE}: {e}")
+
+    # Fallback - create template config file
+    write_json_file(APP_CONFIG_TEMPLATE, APP_CONFIG_FILE)
+
+    say_error(f"{ERR}Configuration not found. Created template: {APP_CONFIG_FILE}")
+    say("Please update the Record UIDs in this file and run again.")
+    return None
+
+def validate_app_config(app_config):
+    """Check the app configuration has real Record UIDs (reports and returns False if not)"""
+    # One lookup per key; the template placeholders are caught by the set check,
+    # other hand-edited 'YOUR_...' values by the prefix check
+    missing_keys = [
+        k for k, v in ((k, app_config.get(k)) for k in REQUIRED_APP_CONFIG_KEYS)
+        if not v or v in PLACEHOLDERS or v.startswith('YOUR_')
+    ]
+
+    if missing_keys:
+        say_error(f"{ERR}Missing configuration: {missing_keys}")
+        say(f"Please update {APP_CONFIG_FILE} with actual Record UIDs")
+        return False
+
+    return True
+
+class CachedSecretsManager:
+    """SecretsManager wrapper that remembers fetched records by UID
+    
+    get_secrets() only asks Keeper for UIDs it hasn't seen yet, and a full fetch
+    (get_secrets([]), as done by the connection test) fills the cache for every record.
+    save() drops the saved record from the cache, so the next get_secrets() fetches it again.
+    Everything else is passed through to the wrapped SecretsManager.
+    """
+    
+    def __init__(self, secrets_manager):
+        self._secrets_manager = secrets_manager
+        self._records = {}
+        self._lock = threading.Lock()
+    
+    def get_secrets(self, uids=None, full_response=False):
+        if isinstance(uids, str):
+            uids = [uids]
+        
+        # The full response carries more than the records, so it always comes from Keeper
+        if full_response:
+            return self._secrets_manager.get_secrets(uids, full_response=True)
+        
+        if not uids:
+            records = self._secrets_manager.get_secrets(uids)
+            with self._lock:
+                self._records.update((record.uid, record) for record in records)
+            return records
+        
+        with self._lock:
+            misses = [uid for uid in uids if uid not in self._records]
+        
+        if misses:
+            fetched = self._secrets_manager.get_secrets(misses)
+            with self._lock:
+                self._records.update((record.uid, record) for record in fetched)
+        
+        with self._lock:
+            return [self._records[uid] for uid in uids if uid in self._records]
+    
+    def save(self, record, *args, **kwargs):
+        try:
+            return self._secrets_manager.save(record, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._records.pop(record.uid, None)
+    
+    def __getattr__(self, name):
+        return getattr(self._secrets_manager, name)
+
+@functools.lru_cache(maxsize=None)
+def keeper_sdk():
+    """Import the Keeper SDK on first use (it pulls in cryptography and requests)
+    
+    Returns a namespace with SecretsManager, FileKeyValueStorage and CachedFileKeyValueStorage.
+    """
+    from keeper_secrets_manager_core import SecretsManager
+    from keeper_secrets_manager_core.storage import FileKeyValueStorage
+    
+    class CachedFileKeyValueStorage(FileKeyValueStorage):
+        """FileKeyValueStorage that parses the config file once instead of on every lookup
+        
+        Writes (key rotation, app binding) still go straight to the file and drop the cached copy.
+        """
+        
+        def __init__(self, config_file_location=None):
+            super().__init__(config_file_location)
+            self._config = None
+        
+        def read_storage(self):
+            if self._config is None:
+                self._config = super().read_storage()
+            return self._config
+        
+        def save_storage(self, updated_config):
+            self._config = None
+            super().save_storage(updated_config)
+    
+    return types.SimpleNamespace(
+        SecretsManager=SecretsManager,
+        FileKeyValueStorage=FileKeyValueStorage,
+        CachedFileKeyValueStorage=CachedFileKeyValueStorage
+    )
+
+@functools.lru_cache(maxsize=4)
+def _get_secrets_manager(config_path, config_mtime):
+    """Build a SecretsManager for a KSM config file (memoized per file version)
+    
+    The file is parsed once - FileKeyValueStorage would re-read and re-parse it on every
+    lookup - while changes the SDK makes to its config are still saved back to the file.
+    """
+    sdk = keeper_sdk()
+    return CachedSecretsManager(sdk.SecretsManager(config=sdk.CachedFileKeyValueStorage(config_path)))
+
+# Serializes construction so concurrent callers share one SecretsManager
+_secrets_manager_lock = threading.Lock()
+
+def get_secrets_manager(config_path=KSM_CONFIG_FILE, config_mtime=None):
+    """Return the shared SecretsManager for a KSM config file (rebuilt only when the file changes)"""
+    if config_mtime is None:
+        config_mtime = os.stat(config_path).st_mtime
+    with _secrets_manager_lock:
+        return _get_secrets_manager(config_path, config_mtime)
+
+def fetch_records(secrets_manager, record_uids):
+    """Fetch several Keeper records in a single request, keyed by Record UID"""
+    records = secrets_manager.get_secrets(record_uids)
+    return {record.uid: record for record in records}
+
+def format_utc(timestamp):
+    """Format Unix epoch seconds as 'YYYY-MM-DD HH:MM:SS' in UTC"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+def read_custom_fields(record, field_coerce):
+    """Read a record's custom fields in one pass, using a label -> (coerce, key) table
+    
+    Returns {key: value} for the fields that are set and coerce cleanly.
+    """
+    values = {}
+    for field in record.dict.get('custom', []):
+        entry = field_coerce.get((field.get('label') or '').lower())
+        field_values = field.get('value')
+        if entry is None or not field_values:
+            continue
+        coerce, key = entry
+        # Keeper field values are lists - use the first entry (field_values is non-empty here)
+        try:
+            value = coerce(field_values[0] if type(field_values) is list else field_values)
+        except (TypeError, ValueError):
+            continue
+        if value:
+            values[key] = value
+    return values
+
+def _atomic_write(path, data, mode, durable=False):
+    """Replace a file with bytes via a unique temp file in the same directory, then os.replace
+    
+    Readers see either the old file or the complete new one, and overlapping runs each
+    write their own temp file instead of truncating another run's.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.fspath(path)) or '.', suffix='.tmp')
+    try:
+        try:
+            os.fchmod(fd, mode)
+            os.write(fd, data)
+            if durable:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def write_secret_file(path, data, durable=False):
+    """Atomically replace a file with bytes readable by the owner only (fsync only when durable is requested)"""
+    # mkstemp creates the temp file 0o600 - no window where the file is world-readable
+    _atomic_write(path, data, 0o600, durable=durable)
@@ -0,0 +1,35 @@
+"""
+JWT Helper - Use the synced JWT token in your own code
+Reads the JWT saved by local_jwt_sync.py once and keeps it in memory until the file changes
+"""
+
+import os
+
+# Default location written by local_jwt_sync.py (secrets_dir / jwt_filename)
+DEFAULT_JWT_PATH = os.path.join("secrets", "api_access.jwt")
+
+# Cached (mtime, token, Authorization header) per path, replaced when the file's mtime changes
+_cache = {}
+
+def _load_entry(path, cached=True):
+    """Return the (mtime, token, header) entry for path, re-reading the file only when it changes"""
+
+    mtime = os.stat(path).st_mtime_ns
+    entry = _cache.get(path)
+
+    if not cached or entry is None or entry[0] != mtime:
+        with open(path, 'rb') as f:
+            token = f.read().decode('utf-8').strip()
+
+        # One tuple per path, swapped in whole - concurrent callers never see another path's token
+        entry = _cache[path] = (mtime, token, f"Bearer {token}")
+
+    return entry
+
+def load_jwt(path=DEFAULT_JWT_PATH, cached=True):
+    """Return the JWT token from the local file (re-read only when the file changes)"""
+    return _load_entry(path, cached)[1]
+
+def auth_header(path=DEFAULT_JWT_PATH):
+    """Return the prebuilt 'Bearer <token>' value for the Authorization header"""
+    return _load_entry(path)[2]
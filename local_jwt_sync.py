@@ -7,402 +7,507 @@ Retrieves the latest JWT token from Keeper Vault for local development
 import os
 import sys
 import json
-import jwt
-import datetime
-from pathlib import Path
-from keeper_secrets_manager_core import SecretsManager
-from keeper_secrets_manager_core.storage import FileKeyValueStorage
+import functools
+import hashlib
+import time
+import argparse
+import base64
+from dataclasses import dataclass
+from typing import Optional
 
-# KSM Configuration - Use standard filename
-KSM_CONFIG_FILE = "client-config.json"
+from jwt_common import (
+    KSM_CONFIG_FILE, OK, ERR, WARN, INFO,
+    say, say_warning, say_error, flush_output, read_json_file, write_json_file,
+    load_app_config, validate_app_config,
+    get_secrets_manager, fetch_records, write_secret_file, read_custom_fields,
+    format_utc
+)
 
-# Application Configuration
-APP_CONFIG_FILE = "app_config.json"
+# PyJWT and the Keeper SDK (which pulls in cryptography) are imported where
+# they are used, so --help and early config errors don't pay for them
 
-def test_existing_ksm_config():
-    """Test if existing KSM configuration works"""
+# Local JWT configuration defaults (overridden by the Keeper config record)
+DEFAULT_JWT_CONFIG = {
+    "secrets_dir": "secrets",
+    "jwt_filename": "api_access.jwt"
+}
+
+# Custom fields read from the JWT config record: label -> (coerce, jwt_config key)
+_FIELD_COERCE = {key: (str, key) for key in DEFAULT_JWT_CONFIG}
+
+# Sync cache - remembers where the last synced JWT was saved (no secrets stored)
+SYNC_CACHE_FILE = ".jwt_sync_cache.json"
+
+# With --if-expiring, skip the Keeper round-trip while the local JWT has at least this long left
+REFRESH_MARGIN_SECONDS = 300
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Sync the latest JWT token from Keeper Vault")
+    parser.add_argument(
+        "--if-expiring",
+        action="store_true",
+        help="Only retrieve the JWT from Keeper when the last synced copy is about to expire"
+    )
+    parser.add_argument(
+        "--durable",
+        action="store_true",
+        help="fsync the JWT file after writing it"
+    )
+    return parser.parse_args()
+
+def test_existing_ksm_config(record_uids):
+    """Test the existing KSM configuration by fetching the records this sync needs"""
     
-    if not os.path.exists(KSM_CONFIG_FILE):
-        print(f"❌ No KSM config found: {KSM_CONFIG_FILE}")
-        print("Please ensure KSM is set up for this project.")
-        print("Contact your team or run the server setup script first.")
+    # One stat serves both the existence check and the memoization key
+    try:
+        ksm_config_stat = os.stat(KSM_CONFIG_FILE)
+    except FileNotFoundError:
+        ksm_config_stat = None
+    
+    if ksm_config_stat is None:
+        say_error(f"{ERR}No KSM config found: {KSM_CONFIG_FILE}")
+        say("Please ensure KSM is set up for this project.")
+        say("Contact your team or run the server setup script first.")
         return None
     
-    print(f"✅ Found KSM configuration: {KSM_CONFIG_FILE}")
+    say(f"{OK}Found KSM configuration: {KSM_CONFIG_FILE}")
     
     try:
         # Test the existing configuration
-        secrets_manager = SecretsManager(
-            config=FileKeyValueStorage(KSM_CONFIG_FILE)
+        secrets_manager = get_secrets_manager(
+            KSM_CONFIG_FILE, ksm_config_stat.st_mtime
         )
         
-        print("🧪 Testing KSM connection...")
+        say("🧪 Testing KSM connection...")
         
-        # Try a simple operation to verify connection works
-        secrets_manager.get_secrets([])  # Empty list is safe - just tests connection
+        # Fetching the records we need doubles as the connection test
+        flush_output()  # Show progress before waiting on the network
+        records = fetch_records(secrets_manager, record_uids)
         
-        print("✅ KSM connection works perfectly!")
-        return secrets_manager
+        say(f"{OK}KSM connection works perfectly!")
+        return records
         
     except Exception as e:
-        print(f"❌ KSM connection failed: {e}")
-        print()
-        print("💡 Possible issues:")
-        print("   • The KSM configuration is from a different application")
-        print("   • Network connection to Keeper servers")
-        print("   • The KSM application may be disabled")
-        print("   • Contact your team for the correct KSM setup")
+        say_error(f"{ERR}KSM connection failed: {e}")
+        say()
+        say("💡 Possible issues:")
+        say("   • The KSM configuration is from a different application")
+        say("   • Network connection to Keeper servers")
+        say("   • The KSM application may be disabled")
+        say("   • Contact your team for the correct KSM setup")
         return None
 
-def load_app_config():
-    """Load application configuration (Record UIDs)"""
-    
-    config = {}
-    
-    # Try environment variables first
-    if os.getenv("JWT_TOKEN_RECORD_UID") and os.getenv("JWT_CONFIG_RECORD_UID"):
-        config = {
-            "jwt_token_record_uid": os.getenv("JWT_TOKEN_RECORD_UID"),
-            "jwt_config_record_uid": os.getenv("JWT_CONFIG_RECORD_UID")
-        }
-        print("📋 Using configuration from environment variables")
-        return config
-    
-    # Try app config file
-    if os.path.exists(APP_CONFIG_FILE):
-        try:
-            with open(APP_CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-            print(f"📋 Using configuration from {APP_CONFIG_FILE}")
-            return config
-        except Exception as e:
-            print(f"❌ Error reading {APP_CONFIG_FILE}: {e}")
-    
-    # Fallback - create template config file
-    template_config = {
-        "jwt_token_record_uid": "YOUR_JWT_TOKEN_RECORD_UID",
-        "jwt_config_record_uid": "YOUR_JWT_CONFIG_RECORD_UID"
-    }
-    
-    with open(APP_CONFIG_FILE, 'w') as f:
-        json.dump(template_config, f, indent=2)
-    
-    print(f"❌ Configuration not found. Created template: {APP_CONFIG_FILE}")
-    print("Please update the Record UIDs in this file and run again.")
-    return None
-
-def load_jwt_config_from_keeper(secrets_manager, config_record_uid):
-    """Load JWT configuration from Keeper Vault"""
+def load_jwt_config_from_keeper(records, config_record_uid):
+    """Load JWT configuration from the fetched Keeper records"""
     
     try:
-        print(f"🔧 Loading JWT configuration from Keeper...")
+        say(f"🔧 Loading JWT configuration from Keeper...")
         
-        # Get the config record
-        config_records = secrets_manager.get_secrets([config_record_uid])
+        config_record = records.get(config_record_uid)
         
-        if not config_records:
-            print(f"❌ JWT config record not found: {config_record_uid}")
+        if not config_record:
+            say_error(f"{ERR}JWT config record not found: {config_record_uid}")
             return None
         
-        config_record = config_records[0]
-        
         # Extract configuration with defaults
-        jwt_config = {
-            "secrets_dir": "secrets",
-            "jwt_filename": "api_access.jwt"
-        }
+        jwt_config = dict(DEFAULT_JWT_CONFIG)
         
-        # Override with custom fields if they exist
-        for field in config_record.fields:
-            field_label = field.get('label', '').lower()
-            field_value = field.get('value', [{}])[0].get('value', '')
-            
-            if field_label == 'secrets_dir' and field_value:
-                jwt_config['secrets_dir'] = field_value
-            elif field_label == 'jwt_filename' and field_value:
-                jwt_config['jwt_filename'] = field_value
+        # Override the defaults with the custom fields that are set
+        jwt_config.update(read_custom_fields(config_record, _FIELD_COERCE))
         
-        print(f"🔧 JWT Configuration:")
-        print(f"   Secrets dir: {jwt_config['secrets_dir']}")
-        print(f"   JWT filename: {jwt_config['jwt_filename']}")
+        say(f"🔧 JWT Configuration:")
+        say(f"   Secrets dir: {jwt_config['secrets_dir']}")
+        say(f"   JWT filename: {jwt_config['jwt_filename']}")
         
-        return jwt_config
+        return resolve_jwt_path(jwt_config)
         
     except Exception as e:
-        print(f"❌ Error loading JWT config: {e}")
+        say_error(f"{ERR}Error loading JWT config: {e}")
         # Return defaults on error
-        return {
-            "secrets_dir": "secrets",
-            "jwt_filename": "api_access.jwt"
-        }
+        return resolve_jwt_path(dict(DEFAULT_JWT_CONFIG))
+
+def resolve_jwt_path(jwt_config):
+    """Resolve the local JWT file path once, for the backup, save and verify steps"""
+    jwt_config['_jwt_path'] = os.path.join(jwt_config['secrets_dir'], jwt_config['jwt_filename'])
+    return jwt_config
 
 def ensure_directories(secrets_dir):
     """Create necessary directories"""
-    secrets_path = Path(secrets_dir)
-    secrets_path.mkdir(exist_ok=True)
-    return secrets_path
+    os.makedirs(secrets_dir, mode=0o700, exist_ok=True)  # Owner-only when newly created
+    return os.path.abspath(secrets_dir)
 
-def remove_old_jwt(jwt_config):
-    """Remove old JWT file if it exists"""
+def remove_old_jwt(jwt_config, jwt_token):
+    """Back up the old JWT file unless it already holds the new token
     
-    secrets_dir = jwt_config['secrets_dir']
-    jwt_filename = jwt_config['jwt_filename']
-    jwt_path = Path(secrets_dir) / jwt_filename
+    Returns 'backed_up', 'unchanged' or 'missing'.
+    """
     
-    if jwt_path.exists():
-        # Backup old JWT with timestamp
-        backup_name = f"{jwt_filename}.backup.{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        backup_path = jwt_path.parent / backup_name
-        
-        jwt_path.rename(backup_path)
-        print(f"🗂️  Old JWT backed up: {backup_path}")
-        return True
-    else:
-        print(f"ℹ️  No existing JWT found at: {jwt_path}")
-        return False
+    jwt_path = jwt_config['_jwt_path']
+    
+    # Don't churn the backups when the local JWT is already the latest one
+    try:
+        with open(jwt_path, 'rb') as f:
+            old_digest = hashlib.sha256(f.read()).digest()
+    except FileNotFoundError:
+        say(f"{INFO}No existing JWT found at: {jwt_path}")
+        return 'missing'
+    
+    if old_digest == hashlib.sha256(jwt_token.encode('utf-8')).digest():
+        say(f"{OK}Local JWT already matches Keeper - no backup needed")
+        return 'unchanged'
+    
+    # Backup old JWT with timestamp
+    backup_path = f"{jwt_path}.backup.{time.strftime('%Y%m%d_%H%M%S', time.localtime())}"
+    
+    try:
+        os.replace(jwt_path, backup_path)
+    except FileNotFoundError:
+        say(f"{INFO}No existing JWT found at: {jwt_path}")
+        return 'missing'
+    
+    say(f"🗂️  Old JWT backed up: {backup_path}")
+    return 'backed_up'
+
+@dataclass
+class JwtInfo:
+    """JWT token with its metadata, decoded once for status and summary output"""
+    token: str
+    exp: Optional[int] = None  # Unix epoch seconds
+    time_left: Optional[int] = None  # Seconds until exp (negative once expired)
+    valid: bool = True
+    issuer: str = 'Unknown'
+    audience: str = 'Unknown'
+    generated_at: str = 'Unknown'
+
+@functools.lru_cache(maxsize=8)
+def _decode_unverified(jwt_token):
+    """Decode a JWT payload without signature verification (memoized)"""
+    import jwt
+    return jwt.decode(jwt_token, options={"verify_signature": False})
+
+def format_duration(seconds):
+    """Format a number of seconds as H:MM:SS (with days if longer), like a timedelta"""
+    days, seconds = divmod(int(seconds), 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    clock = f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{days} day{'s' if days != 1 else ''}, {clock}" if days else clock
+
+def describe_jwt(jwt_token):
+    """Decode a JWT without verification and precompute its expiration details"""
+    
+    payload = _decode_unverified(jwt_token)
+    jwt_info = JwtInfo(
+        token=jwt_token,
+        issuer=payload.get('iss', 'Unknown'),
+        audience=payload.get('aud', 'Unknown'),
+        generated_at=payload.get('generated_at', 'Unknown')
+    )
+    
+    exp_timestamp = payload.get('exp')
+    if exp_timestamp:
+        jwt_info.exp = exp_timestamp
+        jwt_info.time_left = int(exp_timestamp - time.time())
+        jwt_info.valid = jwt_info.time_left > 0
+    
+    return jwt_info
+
+def quick_exp(jwt_token):
+    """Read the top-level exp claim of a JWT, skipping PyJWT entirely (None if absent or invalid)"""
+    try:
+        payload_segment = jwt_token.split('.')[1]
+        payload = json.loads(base64.urlsafe_b64decode(payload_segment + '=' * (-len(payload_segment) % 4)))
+        exp = payload['exp']
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+    
+    # NumericDate may be a float; anything else (including booleans) isn't a usable expiry
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+        return None
+    return int(exp)
 
-def retrieve_jwt_from_keeper(secrets_manager, token_record_uid):
-    """Retrieve the latest JWT from Keeper Vault"""
+def load_cached_jwt(token_record_uid):
+    """Return the locally saved JWT if it was synced from this record and is still fresh"""
     
     try:
-        print(f"📡 Retrieving JWT from Keeper Vault...")
+        cache = read_json_file(SYNC_CACHE_FILE)
+        ksm_config_mtime = os.path.getmtime(KSM_CONFIG_FILE)
+    except (OSError, ValueError):
+        return None
+    
+    # Cache is only valid for the same token record and KSM configuration
+    if (cache.get('jwt_token_record_uid') != token_record_uid
+            or cache.get('ksm_config_mtime') != ksm_config_mtime):
+        return None
+    
+    jwt_path = os.path.join(cache.get('secrets_dir', 'secrets'), cache.get('jwt_filename', 'api_access.jwt'))
+    
+    try:
+        with open(jwt_path, 'rb') as f:
+            jwt_token = f.read().decode('utf-8').strip()
+    except (OSError, ValueError):
+        return None
+    
+    # Only the expiration matters here - the full decode is kept for the verbose info block
+    exp_timestamp = quick_exp(jwt_token)
+    if not exp_timestamp or exp_timestamp - time.time() <= REFRESH_MARGIN_SECONDS:
+        return None
+    
+    return JwtInfo(
+        token=jwt_token,
+        exp=exp_timestamp,
+        time_left=int(exp_timestamp - time.time())
+    )
+
+def save_sync_cache(token_record_uid, jwt_config):
+    """Remember where the JWT for this record was saved"""
+    
+    cache = {
+        "jwt_token_record_uid": token_record_uid,
+        "ksm_config_mtime": os.path.getmtime(KSM_CONFIG_FILE),
+        "secrets_dir": jwt_config['secrets_dir'],
+        "jwt_filename": jwt_config['jwt_filename']
+    }
+    
+    try:
+        write_json_file(cache, SYNC_CACHE_FILE)
+    except OSError as e:
+        say_warning(f"{WARN}Could not update sync cache: {e}")
+
+def retrieve_jwt_from_keeper(records, token_record_uid):
+    """Retrieve the latest JWT from the fetched Keeper records"""
+    import jwt
+    
+    try:
+        say(f"📡 Retrieving JWT from Keeper Vault...")
         
-        # Retrieve JWT record
-        token_records = secrets_manager.get_secrets([token_record_uid])
+        jwt_record = records.get(token_record_uid)
         
-        if not token_records:
-            print(f"❌ JWT token record not found: {token_record_uid}")
-            print("💡 Possible issues:")
-            print("   • Record UID is incorrect")
-            print("   • Record is not shared with your KSM application")
-            print("   • Contact your team for the correct Record UID")
-            return None, None
+        if not jwt_record:
+            say_error(f"{ERR}JWT token record not found: {token_record_uid}")
+            say("💡 Possible issues:")
+            say("   • Record UID is incorrect")
+            say("   • Record is not shared with your KSM application")
+            say("   • Contact your team for the correct Record UID")
+            return None
         
-        jwt_record = token_records[0]
-        print(f"📋 Found JWT record: '{jwt_record.title}'")
+        say(f"📋 Found JWT record: '{jwt_record.title}'")
         
         # Extract JWT token
         jwt_token = jwt_record.password
         
         if not jwt_token:
-            print(f"❌ No JWT token found in record password field")
-            print("💡 The server may not have generated a token yet.")
-            print("   Contact your team to run the server JWT generation.")
-            return None, None
+            say_error(f"{ERR}No JWT token found in record password field")
+            say("💡 The server may not have generated a token yet.")
+            say("   Contact your team to run the server JWT generation.")
+            return None
         
         # Try to decode JWT to get metadata (without verification for info)
-        payload = None
         try:
-            # Decode without verification to get payload info
-            payload = jwt.decode(jwt_token, options={"verify_signature": False})
-            print(f"🔍 JWT Token Info:")
-            print(f"   Issuer: {payload.get('iss', 'Unknown')}")
-            print(f"   Audience: {payload.get('aud', 'Unknown')}")
-            print(f"   Generated: {payload.get('generated_at', 'Unknown')}")
+            jwt_info = describe_jwt(jwt_token)
+            say(f"🔍 JWT Token Info:")
+            say(f"   Issuer: {jwt_info.issuer}")
+            say(f"   Audience: {jwt_info.audience}")
+            say(f"   Generated: {jwt_info.generated_at}")
             
             # Check expiration
-            exp_timestamp = payload.get('exp')
-            if exp_timestamp:
-                exp_datetime = datetime.datetime.fromtimestamp(exp_timestamp)
-                now = datetime.datetime.utcnow()
-                
-                if exp_datetime > now:
-                    time_left = exp_datetime - now
-                    print(f"   Expires: {exp_datetime.strftime('%Y-%m-%d %H:%M:%S')} UTC")
-                    print(f"   Time left: {time_left}")
-                    print(f"   ✅ Token is valid")
+            if jwt_info.exp:
+                say(f"   Expires: {format_utc(jwt_info.exp)} UTC")
+                if jwt_info.valid:
+                    say(f"   Time left: {format_duration(jwt_info.time_left)}")
+                    say(f"   {OK}Token is valid")
                 else:
-                    print(f"   Expires: {exp_datetime.strftime('%Y-%m-%d %H:%M:%S')} UTC")
-                    print(f"   ❌ Token has expired!")
-                    print(f"   Contact your team to generate a new token")
+                    say_error(f"   {ERR}Token has expired!")
+                    say(f"   Contact your team to generate a new token")
             
         except jwt.InvalidTokenError as e:
-            print(f"⚠️  Could not decode JWT for info: {e}")
-            print(f"   Token will be saved anyway")
+            jwt_info = JwtInfo(token=jwt_token)
+            say_warning(f"{WARN}Could not decode JWT for info: {e}")
+            say(f"   Token will be saved anyway")
         
         # Get additional metadata from record
         notes = getattr(jwt_record, 'notes', '')
         if notes:
-            print(f"📝 Notes: {notes}")
+            say(f"📝 Notes: {notes}")
         
-        return jwt_token, payload
+        return jwt_info
         
     except Exception as e:
-        print(f"❌ Error retrieving JWT from Keeper: {e}")
-        return None, None
+        say_error(f"{ERR}Error retrieving JWT from Keeper: {e}")
+        return None
 
-def save_jwt_locally(jwt_token, jwt_config):
-    """Save the new JWT token locally"""
+def save_jwt_locally(jwt_token, jwt_config, durable=False):
+    """Save the new JWT token locally (fsync only when durable is requested)"""
     
-    secrets_dir = jwt_config['secrets_dir']
-    jwt_filename = jwt_config['jwt_filename']
-    jwt_path = Path(secrets_dir) / jwt_filename
+    jwt_path = jwt_config['_jwt_path']
     
     try:
-        with open(jwt_path, 'w') as f:
-            f.write(jwt_token)
+        # Create with restrictive permissions (owner only), replacing the old file atomically
+        write_secret_file(jwt_path, jwt_token.encode('utf-8'), durable=durable)
         
-        # Set restrictive permissions (owner only)
-        os.chmod(jwt_path, 0o600)
-        
-        print(f"💾 JWT saved locally: {jwt_path.absolute()}")
-        print(f"🔒 File permissions set to owner-only (600)")
+        say(f"💾 JWT saved locally: {os.path.abspath(jwt_path)}")
+        say(f"🔒 File permissions set to owner-only (600)")
         
         return jwt_path
         
     except Exception as e:
-        print(f"❌ Error saving JWT locally: {e}")
+        say_error(f"{ERR}Error saving JWT locally: {e}")
         return None
 
-def verify_jwt_access(jwt_config):
-    """Verify the JWT can be read and used"""
-    
-    secrets_dir = jwt_config['secrets_dir']
-    jwt_filename = jwt_config['jwt_filename']
-    jwt_path = Path(secrets_dir) / jwt_filename
-    
-    if not jwt_path.exists():
-        print(f"❌ JWT file not found: {jwt_path}")
-        return False
-    
+def main():
+    """Run the sync, writing out all queued status output on every exit path"""
     try:
-        with open(jwt_path, 'r') as f:
-            token = f.read().strip()
-        
-        if len(token) > 0:
-            print(f"✅ JWT file readable: {len(token)} characters")
-            print(f"🔗 Token preview: {token[:30]}...")
-            return True
-        else:
-            print(f"❌ JWT file is empty")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Error reading JWT file: {e}")
-        return False
+        _main()
+    finally:
+        flush_output()
 
-def main():
-    print("🔄 Local JWT Sync - Uses Existing KSM Configuration")
-    print("=" * 50)
-    print()
-    
-    # Step 1: Test existing KSM configuration
-    print("🔍 Checking KSM configuration...")
-    secrets_manager = test_existing_ksm_config()
-    
-    if not secrets_manager:
-        print()
-        print("💡 To fix KSM configuration:")
-        print("   1. Contact your team for KSM setup instructions")
-        print("   2. Ensure you have access to the correct KSM application")
-        print("   3. Verify network connectivity to Keeper servers")
-        sys.exit(1)
+def _main():
+    args = parse_args()
     
-    print()
+    say("🔄 Local JWT Sync - Uses Existing KSM Configuration")
+    say("=" * 50)
+    say()
     
-    # Step 2: Load app configuration
+    # Step 1: Load app configuration
     app_config = load_app_config()
     if not app_config:
         sys.exit(1)
     
     # Validate config
-    required_keys = ['jwt_token_record_uid', 'jwt_config_record_uid']
-    missing_keys = [k for k in required_keys if not app_config.get(k) or app_config[k].startswith('YOUR_')]
+    if not validate_app_config(app_config):
+        sys.exit(1)
     
-    if missing_keys:
-        print(f"❌ Missing configuration: {missing_keys}")
-        print(f"Please update {APP_CONFIG_FILE} with actual Record UIDs")
+    say()
+    
+    # Opt-in: skip Keeper entirely while the last synced JWT is still fresh. A plain run
+    # always syncs, so it picks up a token the server has just rotated
+    if args.if_expiring:
+        cached_info = load_cached_jwt(app_config['jwt_token_record_uid'])
+        if cached_info:
+            say("⚡ Local JWT is still valid - skipping Keeper sync")
+            say(f"   📅 Expires: {format_utc(cached_info.exp)} UTC")
+            say("💡 Run without --if-expiring to retrieve the JWT from Keeper anyway")
+            return
+    
+    # Step 2: Test existing KSM configuration, fetching the JWT config and token records in one request
+    say("🔍 Checking KSM configuration...")
+    records = test_existing_ksm_config(
+        [app_config['jwt_config_record_uid'], app_config['jwt_token_record_uid']]
+    )
+    
+    if records is None:
+        say()
+        say("💡 To fix KSM configuration:")
+        say("   1. Contact your team for KSM setup instructions")
+        say("   2. Ensure you have access to the correct KSM application")
+        say("   3. Verify network connectivity to Keeper servers")
         sys.exit(1)
     
-    print()
+    say()
     
     # Step 3: Load JWT configuration from Keeper
     jwt_config = load_jwt_config_from_keeper(
-        secrets_manager, 
+        records, 
         app_config['jwt_config_record_uid']
     )
     
     if not jwt_config:
-        print("❌ Failed to load JWT configuration")
+        say_error(f"{ERR}Failed to load JWT configuration")
         sys.exit(1)
     
-    print()
+    say()
     
-    # Step 4: Setup directories
-    print("📁 Setting up local environment...")
-    secrets_path = ensure_directories(jwt_config['secrets_dir'])
-    print(f"✅ Secrets directory: {secrets_path.absolute()}")
-    print()
-    
-    # Step 5: Remove old JWT
-    print("🗑️  Managing old JWT...")
-    had_old_jwt = remove_old_jwt(jwt_config)
-    print()
-    
-    # Step 6: Retrieve new JWT from Keeper
-    print("☁️  Retrieving latest JWT from Keeper Vault...")
-    jwt_token, payload = retrieve_jwt_from_keeper(
-        secrets_manager, 
+    # Step 4: Retrieve new JWT from Keeper
+    say("☁️  Retrieving latest JWT from Keeper Vault...")
+    jwt_info = retrieve_jwt_from_keeper(
+        records, 
         app_config['jwt_token_record_uid']
     )
     
-    if not jwt_token:
-        print("❌ Failed to retrieve JWT from Keeper")
-        print()
-        print("💡 Common solutions:")
-        print("   1. Ask your team to generate a new JWT token")
-        print("   2. Verify the Record UID in app_config.json")
-        print("   3. Ensure the record is shared with your KSM application")
+    if not jwt_info:
+        say_error(f"{ERR}Failed to retrieve JWT from Keeper")
+        say()
+        say("💡 Common solutions:")
+        say("   1. Ask your team to generate a new JWT token")
+        say("   2. Verify the Record UID in app_config.json")
+        say("   3. Ensure the record is shared with your KSM application")
         sys.exit(1)
     
-    print("✅ JWT retrieved successfully from Keeper")
-    print()
+    # Never replace the local JWT with one that has already expired
+    if not jwt_info.valid:
+        say_error(f"{ERR}The JWT in Keeper has expired - local JWT left untouched")
+        say()
+        say("💡 Ask your team to generate a new JWT token, then sync again")
+        sys.exit(2)
+    
+    jwt_token = jwt_info.token
+    say(f"{OK}JWT retrieved successfully from Keeper")
+    say()
     
-    # Step 7: Save JWT locally
-    print("💾 Saving JWT locally...")
-    saved_path = save_jwt_locally(jwt_token, jwt_config)
+    # Step 5: Setup directories
+    say("📁 Setting up local environment...")
+    secrets_path = ensure_directories(jwt_config['secrets_dir'])
+    say(f"{OK}Secrets directory: {secrets_path}")
+    say()
+    
+    # Step 6: Back up old JWT
+    say("🗑️  Managing old JWT...")
+    old_jwt = remove_old_jwt(jwt_config, jwt_token)
+    say()
+    
+    # Step 7: Save JWT locally (nothing to write if the file already holds this token)
+    say("💾 Saving JWT locally...")
+    if old_jwt == 'unchanged':
+        saved_path = jwt_config['_jwt_path']
+        say(f"{OK}JWT already up to date: {os.path.abspath(saved_path)}")
+    else:
+        saved_path = save_jwt_locally(jwt_token, jwt_config, durable=args.durable)
     
     if not saved_path:
-        print("❌ Failed to save JWT locally")
+        say_error(f"{ERR}Failed to save JWT locally")
         sys.exit(1)
     
-    print()
+    say()
     
-    # Step 8: Verify access
-    print("🔍 Verifying JWT access...")
-    access_ok = verify_jwt_access(jwt_config)
-    print()
+    # Step 8: Verify access (from the in-memory token - no need to re-read the file)
+    say("🔍 Verifying JWT access...")
+    access_ok = bool(jwt_token) and os.path.exists(saved_path)
+    if access_ok:
+        say(f"{OK}JWT file ready: {len(jwt_token)} characters")
+        say(f"🔗 Token preview: {jwt_token[:30]}...")
+    else:
+        say_error(f"{ERR}JWT file not found: {saved_path}")
+    say()
     
     # Summary
-    print("📊 Sync Summary:")
-    print(f"   ✅ KSM connection: Using {KSM_CONFIG_FILE}")
-    print(f"   {'✅' if had_old_jwt else 'ℹ️ '} Old JWT: {'Backed up' if had_old_jwt else 'None found'}")
-    print(f"   ✅ Configuration: Loaded from Keeper")
-    print(f"   ✅ New JWT: Retrieved from Keeper")
-    print(f"   ✅ Local save: {saved_path}")
-    print(f"   {'✅' if access_ok else '❌'} Verification: {'Passed' if access_ok else 'Failed'}")
-    
-    if payload:
-        exp_timestamp = payload.get('exp')
-        if exp_timestamp:
-            exp_datetime = datetime.datetime.fromtimestamp(exp_timestamp)
-            print(f"   📅 Expires: {exp_datetime.strftime('%Y-%m-%d %H:%M:%S')} UTC")
-    
-    print()
+    say("📊 Sync Summary:")
+    say(f"   {OK}KSM connection: Using {KSM_CONFIG_FILE}")
+    old_jwt_status = {'backed_up': 'Backed up', 'unchanged': 'Already current', 'missing': 'None found'}
+    say(f"   {INFO if old_jwt == 'missing' else OK}Old JWT: {old_jwt_status[old_jwt]}")
+    say(f"   {OK}Configuration: Loaded from Keeper")
+    say(f"   {OK}New JWT: Retrieved from Keeper")
+    say(f"   {OK}Local save: {saved_path}")
+    say(f"   {OK if access_ok else ERR}Verification: {'Passed' if access_ok else 'Failed'}")
+    
+    if jwt_info.exp:
+        say(f"   📅 Expires: {format_utc(jwt_info.exp)} UTC")
+    
+    say()
     
     if access_ok:
-        print("🎉 JWT sync completed successfully!")
-        print("💡 Your local JWT is now up to date and ready for API development.")
-        print()
-        print("🔧 Usage in your code:")
+        save_sync_cache(app_config['jwt_token_record_uid'], jwt_config)
+        say("🎉 JWT sync completed successfully!")
+        say("💡 Your local JWT is now up to date and ready for API development.")
+        say()
+        say("🔧 Usage in your code:")
         secrets_dir = jwt_config['secrets_dir']
         jwt_filename = jwt_config['jwt_filename']
-        print(f"   with open('{secrets_dir}/{jwt_filename}', 'r') as f:")
-        print(f"       jwt_token = f.read().strip()")
-        print(f"   headers = {{'Authorization': f'Bearer {{jwt_token}}'}}")
+        say(f"   from jwt_helper import auth_header")
+        say(f"   headers = {{'Authorization': auth_header('{secrets_dir}/{jwt_filename}')}}")
     else:
-        print("❌ JWT sync completed with errors")
-        print("Please check the error messages above and try again.")
+        say_error(f"{ERR}JWT sync completed with errors")
+        say("Please check the error messages above and try again.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,163 +7,184 @@ Generates JWT tokens using configuration stored in Keeper Vault and distributes
 import os
 import sys
 import json
-import jwt
-import datetime
-from pathlib import Path
-from keeper_secrets_manager_core import SecretsManager
-from keeper_secrets_manager_core.storage import FileKeyValueStorage
+import atexit
+import binascii
+import functools
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# KSM Configuration - Use standard filename
-KSM_CONFIG_FILE = "client-config.json"
+from jwt_common import (
+    KSM_CONFIG_FILE, IS_TTY, OK, ERR, WARN, INFO,
+    say, say_warning, say_error, say_lines, run_captured, flush_output,
+    load_app_config, validate_app_config, get_secrets_manager, fetch_records,
+    write_secret_file, dump_json, read_custom_fields, format_utc, keeper_sdk,
+    CachedSecretsManager
+)
 
-# Application Configuration (can be environment variables or simple config file)
-APP_CONFIG_FILE = "app_config.json"
+# The Keeper SDK (which pulls in cryptography and requests) is only imported on first
+# use through keeper_sdk(), so importing this module or failing early on config doesn't pay for it
 
-def extract_field_value(field):
-    """Extract string value from Keeper field (handles lists)"""
-    if isinstance(field, list) and len(field) > 0:
-        return field[0]
-    return field
+# JWTs are signed with HS256 via hashlib/hmac directly - PyJWT is only needed for decoding.
+# _URLSAFE_TABLE maps the standard base64 alphabet to the URL-safe one.
+_URLSAFE_TABLE = bytes.maketrans(b'+/', b'-_')
+
+def _b64url(data):
+    """Base64url-encode bytes without padding, as used for JWT segments"""
+    return binascii.b2a_base64(data, newline=False).translate(_URLSAFE_TABLE).rstrip(b'=')
+
+@functools.lru_cache(maxsize=4)
+def _keyed_hmac(secret):
+    """HMAC-SHA256 state with the key pads already absorbed (memoized per secret - copy before use)"""
+    return hmac.new(secret, digestmod=hashlib.sha256)
+
+# The header and permissions never change, so they are built once
+_HEADER_SEGMENT = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+_PERMISSIONS = ("api:read", "api:write", "api:deploy")
+
+def iso_utc(timestamp):
+    """Format Unix epoch seconds as an ISO 8601 UTC string"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+@functools.lru_cache(maxsize=4)
+def _payload_template(issuer, audience):
+    """Build the compact payload JSON once per config, leaving %-slots for iat, exp and generated_at"""
+    
+    def claim(value):
+        return json.dumps(value, separators=(',', ':')).replace('%', '%%')
+    
+    return (
+        '{"iss":' + claim(issuer) + ',"aud":' + claim(audience) + ',"iat":%d,"exp":%d'
+        ',"sub":"api-development-access","team":"API Engineers"'
+        ',"permissions":' + claim(_PERMISSIONS) + ',"generated_at":"%s","version":"1.0"}'
+    )
 
 def test_existing_ksm_config():
     """Test if existing KSM configuration works"""
     
-    if not os.path.exists(KSM_CONFIG_FILE):
-        print(f"ℹ️  No existing KSM config found ({KSM_CONFIG_FILE})")
+    # One stat serves both the existence check and the memoization key
+    try:
+        ksm_config_stat = os.stat(KSM_CONFIG_FILE)
+    except FileNotFoundError:
+        ksm_config_stat = None
+    
+    if ksm_config_stat is None:
+        say(f"{INFO}No existing KSM config found ({KSM_CONFIG_FILE})")
         return None
     
-    print(f"✅ Found existing KSM configuration: {KSM_CONFIG_FILE}")
+    say(f"{OK}Found existing KSM configuration: {KSM_CONFIG_FILE}")
     
     try:
         # Test the existing configuration
-        secrets_manager = SecretsManager(
-            config=FileKeyValueStorage(KSM_CONFIG_FILE)
+        secrets_manager = get_secrets_manager(
+            KSM_CONFIG_FILE, ksm_config_stat.st_mtime
         )
         
-        print("🧪 Testing existing KSM connection...")
+        say("🧪 Testing existing KSM connection...")
         
         # Try a simple operation to verify connection works
         # This will fail gracefully if the config is invalid
+        flush_output()  # Show progress before waiting on the network
         secrets_manager.get_secrets([])  # Empty list is safe - just tests connection
         
-        print("✅ Existing KSM configuration works perfectly!")
-        print("ℹ️  No setup required - KSM is already configured for this project")
+        say(f"{OK}Existing KSM configuration works perfectly!")
+        say(f"{INFO}No setup required - KSM is already configured for this project")
         return secrets_manager
         
     except Exception as e:
-        print(f"⚠️  Existing KSM config has issues: {e}")
-        print("🔧 Will attempt to set up fresh configuration...")
+        say_warning(f"{WARN}Existing KSM config has issues: {e}")
+        say("🔧 Will attempt to set up fresh configuration...")
         return None
 
 def setup_ksm_with_token():
     """Set up KSM using one-time token (only if existing config doesn't work)"""
     
-    print()
-    print("🔧 Setting up new Keeper Secrets Manager configuration...")
-    print()
-    print("📝 You need a One-Time Token from Keeper Admin Console:")
-    print("   1. Keeper Vault → Secrets Manager")
-    print("   2. Create/Select Application → Create One-Time Access Token")
-    print("   3. Copy the token (format: REGION:TOKEN)")
-    print()
+    say()
+    say("🔧 Setting up new Keeper Secrets Manager configuration...")
+    say()
+    say("📝 You need a One-Time Token from Keeper Admin Console:")
+    say("   1. Keeper Vault → Secrets Manager")
+    say("   2. Create/Select Application → Create One-Time Access Token")
+    say("   3. Copy the token (format: REGION:TOKEN)")
+    say()
     
+    flush_output()  # Show the instructions before prompting
     one_time_token = input("Enter your One-Time Token (or press Enter to skip): ").strip()
     
     if not one_time_token:
-        print("❌ Setup cancelled - cannot proceed without valid KSM configuration")
+        say_error(f"{ERR}Setup cancelled - cannot proceed without valid KSM configuration")
         return None
     
     try:
-        print("🔗 Initializing connection to Keeper...")
+        say("🔗 Initializing connection to Keeper...")
         
         # Backup existing config if it exists
-        if os.path.exists(KSM_CONFIG_FILE):
-            backup_path = f"{KSM_CONFIG_FILE}.backup.{int(datetime.datetime.now().timestamp())}"
-            os.rename(KSM_CONFIG_FILE, backup_path)
-            print(f"📁 Backed up existing config to: {backup_path}")
+        backup_path = f"{KSM_CONFIG_FILE}.backup.{os.getpid()}.{time.time_ns()}"  # Unique even for concurrent setups
+        try:
+            os.replace(KSM_CONFIG_FILE, backup_path)
+            say(f"📁 Backed up existing config to: {backup_path}")
+        except FileNotFoundError:
+            pass
         
-        # Initialize KSM with one-time token
-        secrets_manager = SecretsManager(
+        # Initialize KSM with one-time token (records from the test fetch are kept for reuse)
+        sdk = keeper_sdk()
+        secrets_manager = CachedSecretsManager(sdk.SecretsManager(
             token=one_time_token,
-            config=FileKeyValueStorage(KSM_CONFIG_FILE)
-        )
+            config=sdk.FileKeyValueStorage(KSM_CONFIG_FILE)
+        ))
         
         # Test the connection
-        print("🧪 Testing new configuration...")
+        say("🧪 Testing new configuration...")
+        flush_output()
         secrets_manager.get_secrets([])  # Test connection
         
-        print(f"✅ New KSM configuration saved to: {KSM_CONFIG_FILE}")
-        print("🎉 KSM setup completed successfully!")
+        say(f"{OK}New KSM configuration saved to: {KSM_CONFIG_FILE}")
+        say("🎉 KSM setup completed successfully!")
         return secrets_manager
         
     except Exception as e:
-        print(f"❌ Setup failed: {e}")
-        print()
-        if "already initialized with a different token" in str(e):
-            print("💡 This suggests there's still a configuration conflict.")
-            print("   The existing config might be from a different KSM application.")
-            print("   Options:")
-            print("   1. Use the existing config (if it works for your team)")
-            print("   2. Contact your team to understand which KSM app to use")
-            print("   3. Create a new KSM application for this project")
+        message = getattr(e, 'message', None) or str(e)  # KeeperError carries its text in .message
+        say_error(f"{ERR}Setup failed: {message}")
+        say()
+        # The SDK reports a config bound to another token as a plain ValueError with no error
+        # code, so the type check narrows it and the message text is the last resort
+        if isinstance(e, ValueError) and "already initialized with a different token" in message:
+            say("💡 This suggests there's still a configuration conflict.")
+            say("   The existing config might be from a different KSM application.")
+            say("   Options:")
+            say("   1. Use the existing config (if it works for your team)")
+            say("   2. Contact your team to understand which KSM app to use")
+            say("   3. Create a new KSM application for this project")
         return None
 
-def load_app_config():
-    """Load application configuration (Record UIDs)"""
-    
-    config = {}
-    
-    # Try environment variables first
-    if os.getenv("JWT_TOKEN_RECORD_UID") and os.getenv("JWT_CONFIG_RECORD_UID"):
-        config = {
-            "jwt_token_record_uid": os.getenv("JWT_TOKEN_RECORD_UID"),
-            "jwt_config_record_uid": os.getenv("JWT_CONFIG_RECORD_UID")
-        }
-        print("📋 Using configuration from environment variables")
-        return config
-    
-    # Try app config file
-    if os.path.exists(APP_CONFIG_FILE):
-        try:
-            with open(APP_CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-            print(f"📋 Using configuration from {APP_CONFIG_FILE}")
-            return config
-        except Exception as e:
-            print(f"❌ Error reading {APP_CONFIG_FILE}: {e}")
-    
-    # Fallback - create template config file
-    template_config = {
-        "jwt_token_record_uid": "YOUR_JWT_TOKEN_RECORD_UID",
-        "jwt_config_record_uid": "YOUR_JWT_CONFIG_RECORD_UID"
-    }
-    
-    with open(APP_CONFIG_FILE, 'w') as f:
-        json.dump(template_config, f, indent=2)
-    
-    print(f"❌ Configuration not found. Created template: {APP_CONFIG_FILE}")
-    print("Please update the Record UIDs in this file and run again.")
-    return None
+# Custom fields read from the JWT config record: label -> (coerce, jwt_config key)
+_FIELD_COERCE = {
+    'issuer': (str, 'issuer'),
+    'audience': (str, 'audience'),
+    'expiration_hours': (int, 'expiration_hours'),
+    'secrets_dir': (str, 'secrets_dir'),
+    'jwt_filename': (str, 'jwt_filename'),
+}
 
-def load_jwt_config_from_keeper(secrets_manager, config_record_uid):
-    """Load JWT configuration from Keeper Vault"""
+def load_jwt_config_from_keeper(records, config_record_uid):
+    """Load JWT configuration from the fetched Keeper records"""
     
     try:
-        print(f"🔧 Loading JWT configuration from Keeper...")
+        say(f"🔧 Loading JWT configuration from Keeper...")
         
-        # Get the config record
-        config_records = secrets_manager.get_secrets([config_record_uid])
+        config_record = records.get(config_record_uid)
         
-        if not config_records:
-            print(f"❌ JWT config record not found: {config_record_uid}")
+        if not config_record:
+            say_error(f"{ERR}JWT config record not found: {config_record_uid}")
             return None
         
-        config_record = config_records[0]
-        print(f"📋 Found config record: '{config_record.title}'")
+        say(f"📋 Found config record: '{config_record.title}'")
         
         # Extract configuration
         jwt_config = {
-            "secret": config_record.password,  # JWT signing secret
+            "secret": config_record.password.encode('utf-8'),  # JWT signing secret (HMAC key bytes)
             "issuer": "api-development-server",  # Default
             "audience": "api-engineers",  # Default
             "expiration_hours": 24,  # Default
@@ -172,127 +193,96 @@ def load_jwt_config_from_keeper(secrets_manager, config_record_uid):
         }
         
         # Override with custom fields if they exist
-        try:
-            issuer_field = config_record.custom_field('issuer')
-            if issuer_field:
-                jwt_config['issuer'] = extract_field_value(issuer_field)
-        except:
-            pass
-
-        try:
-            audience_field = config_record.custom_field('audience')
-            if audience_field:
-                jwt_config['audience'] = extract_field_value(audience_field)
-        except:
-            pass
-
-        try:
-            exp_hours_field = config_record.custom_field('expiration_hours')
-            if exp_hours_field:
-                jwt_config['expiration_hours'] = int(exp_hours_field)
-        except:
-            pass
-
-        try:
-            secrets_dir_field = config_record.custom_field('secrets_dir')
-            if secrets_dir_field:
-                jwt_config['secrets_dir'] = extract_field_value(secrets_dir_field)
-        except:
-            pass
-
-        try:
-            jwt_filename_field = config_record.custom_field('jwt_filename')
-            if jwt_filename_field:
-                jwt_config['jwt_filename'] = extract_field_value(jwt_filename_field)
-        except:
-            pass
+        jwt_config.update(read_custom_fields(config_record, _FIELD_COERCE))
+        
+        say(f"🔧 JWT Configuration loaded:")
+        say(f"   Issuer: {jwt_config['issuer']}")
+        say(f"   Audience: {jwt_config['audience']}")
+        say(f"   Expiration: {jwt_config['expiration_hours']} hours")
+        say(f"   Secrets dir: {jwt_config['secrets_dir']}")
+        say(f"   JWT filename: {jwt_config['jwt_filename']}")
+        say(f"   Secret length: {len(jwt_config['secret'])} bytes")
         
-        print(f"🔧 JWT Configuration loaded:")
-        print(f"   Issuer: {jwt_config['issuer']}")
-        print(f"   Audience: {jwt_config['audience']}")
-        print(f"   Expiration: {jwt_config['expiration_hours']} hours")
-        print(f"   Secrets dir: {jwt_config['secrets_dir']}")
-        print(f"   JWT filename: {jwt_config['jwt_filename']}")
-        print(f"   Secret length: {len(jwt_config['secret'])} characters")
+        # Resolve the output paths once for the save and notification steps
+        secrets_dir = jwt_config['secrets_dir']
+        jwt_config['_jwt_path'] = os.path.join(secrets_dir, jwt_config['jwt_filename'])
+        jwt_config['_log_path'] = os.path.join(secrets_dir, "jwt_notifications.log")
         
         return jwt_config
         
     except Exception as e:
-        print(f"❌ Error loading JWT config from Keeper: {e}")
+        say_error(f"{ERR}Error loading JWT config from Keeper: {e}")
         return None
 
 def ensure_directories(secrets_dir):
     """Create necessary directories"""
-    secrets_path = Path(secrets_dir)
-    secrets_path.mkdir(exist_ok=True)
-    print(f"✅ Secrets directory ready: {secrets_path.absolute()}")
+    os.makedirs(secrets_dir, mode=0o700, exist_ok=True)  # Owner-only when newly created
+    secrets_path = os.path.abspath(secrets_dir)
+    say(f"{OK}Secrets directory ready: {secrets_path}")
     return secrets_path
 
 def generate_jwt(jwt_config):
     """Generate a new JWT token using config from Keeper"""
     
-    # JWT payload
-    now = datetime.datetime.utcnow()
+    # JWT payload - iat/exp are Unix epoch seconds (JWT NumericDate)
+    now_ts = int(time.time())
     exp_hours = jwt_config.get('expiration_hours', 24)
     
     payload = {
         "iss": jwt_config['issuer'],
         "aud": jwt_config['audience'],
-        "iat": now,
-        "exp": now + datetime.timedelta(hours=exp_hours),
+        "iat": now_ts,
+        "exp": now_ts + 3600 * exp_hours,
         "sub": "api-development-access",
         "team": "API Engineers",
-        "permissions": [
-            "api:read",
-            "api:write", 
-            "api:deploy"
-        ],
-        "generated_at": now.isoformat(),
+        "permissions": _PERMISSIONS,
+        "generated_at": iso_utc(now_ts),
         "version": "1.0"
     }
     
-    # Generate JWT
-    token = jwt.encode(payload, jwt_config['secret'], algorithm="HS256")
+    # Only iat, exp and generated_at vary - fill them into the per-config payload template
+    payload_json = _payload_template(payload['iss'], payload['aud']) % (
+        payload['iat'], payload['exp'], payload['generated_at']
+    )
+    
+    # Generate JWT (header.payload.signature, HMAC-SHA256 over the first two segments)
+    signing_input = _HEADER_SEGMENT + b'.' + _b64url(payload_json.encode('utf-8'))
+    mac = _keyed_hmac(jwt_config['secret']).copy()
+    mac.update(signing_input)
+    signature = mac.digest()
+    token = (signing_input + b'.' + _b64url(signature)).decode('ascii')
     
-    print(f"🔑 Generated new JWT token")
-    print(f"   Issuer: {payload['iss']}")
-    print(f"   Audience: {payload['aud']}")
-    print(f"   Expires: {payload['exp'].isoformat()}")
+    say(f"🔑 Generated new JWT token")
+    say(f"   Issuer: {payload['iss']}")
+    say(f"   Audience: {payload['aud']}")
+    say(f"   Expires: {iso_utc(payload['exp'])}")
     
     return token, payload
 
 def save_jwt_locally(token, jwt_config):
     """Save JWT to local secrets folder"""
     
-    secrets_dir = jwt_config.get('secrets_dir', 'secrets')
-    jwt_filename = jwt_config.get('jwt_filename', 'api_access.jwt')
-    
-    jwt_path = Path(secrets_dir) / jwt_filename
-    
-    with open(jwt_path, 'w') as f:
-        f.write(token)
+    jwt_path = jwt_config['_jwt_path']
     
-    # Set secure permissions
-    os.chmod(jwt_path, 0o600)
+    # Create with secure permissions (owner only) - flushed to disk since this is the source copy
+    write_secret_file(jwt_path, token.encode('ascii'), durable=True)
     
-    print(f"💾 JWT saved locally: {jwt_path.absolute()}")
+    say(f"💾 JWT saved locally: {os.path.abspath(jwt_path)}")
     return jwt_path
 
-def update_jwt_in_keeper(secrets_manager, token_record_uid, token, payload):
-    """Update JWT token in Keeper Vault (simulated for POC)"""
+def update_jwt_in_keeper(secrets_manager, records, token_record_uid, token, payload):
+    """Update JWT token in Keeper Vault, using the already fetched token record"""
     
     try:
-        print(f"☁️  Updating JWT in Keeper Vault...")
+        say(f"☁️  Updating JWT in Keeper Vault...")
         
-        # Get the token record
-        token_records = secrets_manager.get_secrets([token_record_uid])
+        token_record = records.get(token_record_uid)
         
-        if not token_records:
-            print(f"❌ JWT token record not found: {token_record_uid}")
+        if not token_record:
+            say_error(f"{ERR}JWT token record not found: {token_record_uid}")
             return False
         
-        token_record = token_records[0]
-        print(f"📋 Found token record: '{token_record.title}'")
+        say(f"📋 Found token record: '{token_record.title}'")
         
         try:
             # Update the password field (main requirement)
@@ -300,37 +290,60 @@ def update_jwt_in_keeper(secrets_manager, token_record_uid, token, payload):
             
             # Try updating notes as a direct property instead of field
             try:
-                notes = f"Generated: {payload['generated_at']}\nExpires: {payload['exp'].isoformat()}"
+                notes = f"Generated: {payload['generated_at']}\nExpires: {iso_utc(payload['exp'])}"
                 token_record.notes = notes  # Direct property assignment for notes
-                print(f"   Notes: Updated with generation info")
+                say(f"   Notes: Updated with generation info")
             except Exception as notes_error:
-                print(f"   Notes: Skipped (not critical) - {notes_error}")
+                say(f"   Notes: Skipped (not critical) - {notes_error}")
             
             # Save the changes
-            print(f"💾 Saving JWT to Keeper Vault...")
+            say(f"💾 Saving JWT to Keeper Vault...")
             secrets_manager.save(token_record)
             
-            print(f"✅ JWT successfully saved to Keeper!")
-            print(f"   Password: {token[:30]}...")
+            say(f"{OK}JWT successfully saved to Keeper!")
+            say(f"   Password: {token[:30]}...")
             
             return True
             
         except Exception as e:
-            print(f"❌ Failed to save JWT to Keeper: {e}")
-            print(f"💡 Fallback - Manual update required:")
-            print(f"   1. Copy JWT from: secrets/api_access.jwt")
-            print(f"   2. Paste into Keeper record password field")
+            say_error(f"{ERR}Failed to save JWT to Keeper: {e}")
+            say(f"💡 Fallback - Manual update required:")
+            say(f"   1. Copy JWT from: secrets/api_access.jwt")
+            say(f"   2. Paste into Keeper record password field")
             return False
         
     except Exception as e:
-        print(f"❌ Error updating JWT in Keeper: {e}")
+        say_error(f"{ERR}Error updating JWT in Keeper: {e}")
         return False
 
+# Notification log descriptors stay open for the life of the process and are closed at exit
+_notification_logs = {}
+_notification_log_lock = threading.Lock()
+
+def append_notification_log(log_file, line):
+    """Append one line (bytes) to a notification log with a single O_APPEND write on a reused fd"""
+    with _notification_log_lock:
+        log_fd = _notification_logs.get(log_file)
+        if log_fd is None:
+            log_fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            _notification_logs[log_file] = log_fd
+        # One write per line - nothing is held back in a buffer if the process dies
+        os.write(log_fd, line + b'\n')
+
+def close_notification_logs():
+    """Close every open notification log"""
+    with _notification_log_lock:
+        for log_fd in _notification_logs.values():
+            os.close(log_fd)
+        _notification_logs.clear()
+
+atexit.register(close_notification_logs)
+
 def send_notification(jwt_config, payload):
     """Send notification to API Engineers team"""
     
     notification_message = {
-        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "timestamp": iso_utc(time.time()),
         "event": "jwt_generated",
         "message": "New API Development JWT token has been generated and is available in Keeper Vault",
         "config": {
@@ -338,31 +351,58 @@ def send_notification(jwt_config, payload):
             "audience": jwt_config['audience'],
             "expiration_hours": jwt_config['expiration_hours']
         },
-        "expires_at": payload['exp'].isoformat(),
+        "expires_at": iso_utc(payload['exp']),
         "action_required": "Run: python3 local_jwt_sync.py",
         "location": "Keeper Vault > API Development Access folder"
     }
     
-    print(f"📢 Notification for API Engineers team:")
-    print(json.dumps(notification_message, indent=2))
+    # Serialized once for the log; only an interactive terminal gets a second, indented dump
+    line = dump_json(notification_message)
+    
+    say(f"📢 Notification for API Engineers team:")
+    say(dump_json(notification_message, indent=True).decode('utf-8') if IS_TTY else line.decode('utf-8'))
     
     # Save notification log
-    secrets_dir = jwt_config.get('secrets_dir', 'secrets')
-    log_file = Path(secrets_dir) / "jwt_notifications.log"
-    with open(log_file, 'a') as f:
-        f.write(f"{json.dumps(notification_message)}\n")
+    log_file = jwt_config['_log_path']
+    append_notification_log(log_file, line)
     
-    print(f"📝 Notification logged to: {log_file}")
+    say(f"📝 Notification logged to: {log_file}")
     
     return True
 
+def report_step(name, future, failed):
+    """Replay a concurrent step's status lines once it finishes and return its result
+    
+    A step that raised is reported once, after any lines it queued before failing;
+    its name is added to failed and None is returned.
+    """
+    try:
+        result, lines = future.result()
+    except Exception as e:
+        say_lines(getattr(e, 'status_lines', []))
+        say_error(f"{ERR}{name} failed: {e}")
+        failed.append(name)
+        result = None
+    else:
+        say_lines(lines)
+    say()
+    flush_output()
+    return result
+
 def main():
-    print("🏗️  JWT Server Generator - Uses Existing KSM Configuration")
-    print("=" * 60)
-    print()
+    """Run the generator, writing out all queued status output on every exit path"""
+    try:
+        _main()
+    finally:
+        flush_output()
+
+def _main():
+    say("🏗️  JWT Server Generator - Uses Existing KSM Configuration")
+    say("=" * 60)
+    say()
     
     # Step 1: Test existing KSM configuration first
-    print("🔍 Checking for existing KSM configuration...")
+    say("🔍 Checking for existing KSM configuration...")
     secrets_manager = test_existing_ksm_config()
     
     if not secrets_manager:
@@ -371,7 +411,7 @@ def main():
         if not secrets_manager:
             sys.exit(1)
     
-    print()
+    say()
     
     # Step 2: Load app configuration  
     app_config = load_app_config()
@@ -379,72 +419,102 @@ def main():
         sys.exit(1)
     
     # Validate config
-    required_keys = ['jwt_token_record_uid', 'jwt_config_record_uid']
-    missing_keys = [k for k in required_keys if not app_config.get(k) or app_config[k].startswith('YOUR_')]
-    
-    if missing_keys:
-        print(f"❌ Missing configuration: {missing_keys}")
-        print(f"Please update {APP_CONFIG_FILE} with actual Record UIDs")
+    if not validate_app_config(app_config):
         sys.exit(1)
     
-    print()
+    say()
+    
+    # Step 3: Load JWT configuration from Keeper (config and token records in one request)
+    flush_output()
+    try:
+        records = fetch_records(
+            secrets_manager,
+            [app_config['jwt_config_record_uid'], app_config['jwt_token_record_uid']]
+        )
+    except Exception as e:
+        say_error(f"{ERR}Error fetching records from Keeper: {e}")
+        sys.exit(1)
     
-    # Step 3: Load JWT configuration from Keeper
     jwt_config = load_jwt_config_from_keeper(
-        secrets_manager, 
+        records, 
         app_config['jwt_config_record_uid']
     )
     
     if not jwt_config:
         sys.exit(1)
     
-    print()
+    say()
     
     # Step 4: Setup directories
     ensure_directories(jwt_config['secrets_dir'])
-    print()
+    say()
     
     # Step 5: Generate JWT
-    print("🔑 Generating new JWT token...")
+    say("🔑 Generating new JWT token...")
     token, payload = generate_jwt(jwt_config)
-    print()
-    
-    # Step 6: Save locally
-    print("💾 Saving JWT locally...")
-    local_path = save_jwt_locally(token, jwt_config)
-    print()
-    
-    # Step 7: Update Keeper
-    print("☁️  Updating JWT in Keeper Vault...")
-    keeper_success = update_jwt_in_keeper(
-        secrets_manager, 
-        app_config['jwt_token_record_uid'], 
-        token, 
-        payload
-    )
-    print()
-    
-    # Step 8: Send notification
-    print("📢 Sending notification...")
-    notification_success = send_notification(jwt_config, payload)
-    print()
+    say()
+    
+    # Steps 6-7 are independent, so the local save and Keeper update run concurrently.
+    # The notification says the token is in Keeper Vault, so it only starts once the
+    # Keeper update has succeeded (it's a local append, so this costs no wall-clock time).
+    # Each step's output is replayed in order as soon as that step has finished.
+    failed = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        save_future = executor.submit(run_captured, save_jwt_locally, token, jwt_config)
+        keeper_future = executor.submit(
+            run_captured,
+            update_jwt_in_keeper,
+            secrets_manager, 
+            records, 
+            app_config['jwt_token_record_uid'], 
+            token, 
+            payload
+        )
+        
+        # Step 6: Save locally
+        say("💾 Saving JWT locally...")
+        local_path = report_step("Local save", save_future, failed)
+        
+        # Step 7: Update Keeper
+        say("☁️  Updating JWT in Keeper Vault...")
+        keeper_success = report_step("Keeper update", keeper_future, failed)
+        
+        # Step 8: Send notification
+        say("📢 Sending notification...")
+        notification_sent = False
+        if keeper_success:
+            notification_future = executor.submit(run_captured, send_notification, jwt_config, payload)
+            notification_sent = report_step("Notification", notification_future, failed)
+        else:
+            say_warning(f"{WARN}Skipped - the new token is not in Keeper Vault")
+            say()
+    
+    if failed:
+        say_error(f"{ERR}JWT generation incomplete - failed: {', '.join(failed)}")
+        if keeper_success:
+            say_warning(f"{WARN}Keeper already holds the new token")
+        else:
+            say_warning(f"{WARN}Keeper was not updated - it still holds the previous token")
+        if notification_sent:
+            say_warning(f"{WARN}Team notification was already sent and logged")
+        sys.exit(1)
     
     # Summary
-    print("📊 Generation Summary:")
-    print(f"   ✅ KSM connection: Using {KSM_CONFIG_FILE}")
-    print(f"   ✅ JWT configuration: Loaded from Keeper")
-    print(f"   ✅ JWT generated: {jwt_config['expiration_hours']} hour expiration")
-    print(f"   ✅ Saved locally: {local_path}")
-    print(f"   {'✅' if keeper_success else '⚠️ '} Keeper update: {'Success' if keeper_success else 'Manual step required'}")
-    print(f"   ✅ Team notification: Sent")
-    print()
-    
-    print("🎉 JWT generation completed!")
-    print(f"📅 Token expires: {payload['exp'].strftime('%Y-%m-%d %H:%M:%S')} UTC")
-    print()
-    print("💡 Next steps:")
-    print("   1. API Engineers can find the new JWT in Keeper Vault")
-    print("   2. API Engineers can run: python3 local_jwt_sync.py")
+    say("📊 Generation Summary:")
+    say(f"   {OK}KSM connection: Using {KSM_CONFIG_FILE}")
+    say(f"   {OK}JWT configuration: Loaded from Keeper")
+    say(f"   {OK}JWT generated: {jwt_config['expiration_hours']} hour expiration")
+    say(f"   {OK}Saved locally: {local_path}")
+    say(f"   {OK if keeper_success else WARN}Keeper update: {'Success' if keeper_success else 'Manual step required'}")
+    say(f"   {OK if notification_sent else WARN}Team notification: {'Sent' if notification_sent else 'Skipped'}")
+    say()
+    
+    say("🎉 JWT generation completed!")
+    say(f"📅 Token expires: {format_utc(payload['exp'])} UTC")
+    say()
+    say("💡 Next steps:")
+    say("   1. API Engineers can find the new JWT in Keeper Vault")
+    say("   2. API Engineers can run: python3 local_jwt_sync.py")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file